@@ -1,9 +1,16 @@
 import streamlit as st
 import pandas as pd
 import re
-import io
+import sys
+import http.cookiejar
+import tempfile
 import traceback
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from pyexcelerate import Workbook, Style
 from espn_api.baseball import League
+from espn_api.requests import espn_requests
 
 # --- STREAMLIT UI SETUP ---
 st.set_page_config(page_title="MLB Roster Exporter", page_icon="⚾", layout="wide")
@@ -50,91 +57,192 @@ with st.sidebar:
     st.divider()
     st.info("The Excel file will be generated based on the credentials selected above.")
 # --- HELPER FUNCTIONS ---
-def auto_adjust_column_width(writer, df, sheet_name):
-    """Adjusts Excel column widths to fit content."""
-    worksheet = writer.sheets[sheet_name]
-    for col_idx, column in enumerate(df.columns):
-        column_width = max(df[column].astype(str).map(len).max(), len(column))
-        worksheet.column_dimensions[chr(65 + col_idx)].width = column_width + 2
+HEADERS = ("Player Name", "Fantasy Team", "Pro Team", "Injury Status", "Eligible Positions")
+EXCLUDED_SLOTS = frozenset({'UTIL', 'BE', 'IL', 'IF', 'LF', 'CF', 'RF', 'SP', 'RP'})
+CACHE_TTL = 300  # seconds
+REPORT_CACHE_ENTRIES = 16  # each entry holds a whole xlsx plus the master DataFrame
+FA_LIMIT = 500
+_SHEET_RE = re.compile(r'[\\/*?:\[\]]')
+
+@st.cache_resource
+def get_positions_cache():
+    """Slot tuple -> joined positions, kept across reruns since it only depends on the slots."""
+    return {}
+
+def intern_value(value):
+    """Interns strings so repeated values share one object (espn_api may also give None or an int)."""
+    return sys.intern(value) if isinstance(value, str) else value
+
+def eligible_positions(slots, positions_by_slots):
+    """Joins a player's eligible slots, minus EXCLUDED_SLOTS, memoized on the slot list."""
+    slots = tuple(slots)
+    positions = positions_by_slots.get(slots)
+    if positions is None:
+        positions = sys.intern(", ".join(slot for slot in slots if slot not in EXCLUDED_SLOTS))
+        positions_by_slots[slots] = positions
+    return positions
+
+def build_columns(players, fantasy_team):
+    """Collects player details into parallel column lists keyed by header."""
+    names, pro_teams, injury_statuses, positions = [], [], [], []
+    positions_by_slots = get_positions_cache()
+    for player in players:
+        names.append(player.name)
+        pro_teams.append(intern_value(player.proTeam))
+        injury_statuses.append(intern_value(player.injuryStatus))
+        positions.append(eligible_positions(player.eligibleSlots, positions_by_slots))
+    return {
+        "Player Name": names,
+        "Fantasy Team": [intern_value(fantasy_team)] * len(names),
+        "Pro Team": pro_teams,
+        "Injury Status": injury_statuses,
+        "Eligible Positions": positions,
+    }
+
+def clean_sheet_name(name, used_names):
+    """Makes a valid, unique (case-insensitive) Excel sheet name of at most 31 characters."""
+    base = _SHEET_RE.sub('', name)[:31] or "Team"
+    sheet_name, copy_num = base, 1
+    while sheet_name.lower() in used_names:
+        copy_num += 1
+        suffix = f" ({copy_num})"
+        sheet_name = base[:31 - len(suffix)] + suffix
+    used_names.add(sheet_name.lower())
+    return sheet_name
+
+def column_width(column, values):
+    """Returns the length of the longest cell in a column, header included."""
+    # map() keeps the per-cell str/len calls in C rather than a Python-level loop
+    return max(len(column), max(map(len, map(str, values)), default=0))
+
+def write_sheet(wb, sheet_name, columns, widths=None):
+    """Adds a sheet built from column lists, sizing columns to fit content. Returns the widths used."""
+    if widths is None:
+        widths = [column_width(column, columns[column]) for column in HEADERS]
+    rows = [HEADERS] + list(zip(*(columns[column] for column in HEADERS)))
+    worksheet = wb.new_sheet(sheet_name, data=rows)
+    for col_idx, width in enumerate(widths):
+        # PyExcelerate columns are 1-indexed
+        worksheet.set_col_style(col_idx + 1, Style(size=width + 2))
+    return widths
+
+@st.cache_resource
+def get_espn_session():
+    """Shared keep-alive session that retries ESPN rate limits and server errors."""
+    retry = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("GET",),
+        raise_on_status=False,  # leave the final status for espn_api to report
+    )
+    adapter = HTTPAdapter(pool_connections=20, pool_maxsize=20, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    # The session is shared by every user, so never store Set-Cookie responses; espn_api
+    # sends each user's credential cookies with every request anyway
+    session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+    return session
+
+# Swaps espn_api's `requests` module for the pooled Session, process-wide, so connections
+# are reused instead of paying a new TLS handshake on every request. This relies on espn_api
+# only ever calling `requests.get` (true as of espn_api 1.0.1); recheck when upgrading it.
+espn_requests.requests = get_espn_session()
+
+# Streamlit reruns the whole script on every interaction (including the download click),
+# so ESPN results and the finished workbook are cached instead of refetched each time
+@st.cache_resource(ttl=CACHE_TTL, show_spinner=False)
+def get_league(league_id, year, swid, espn_s2):
+    """Connects to the league, which also loads every team's roster."""
+    return League(league_id=league_id, year=year, espn_s2=espn_s2, swid=swid)
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def fetch_free_agents(_league, league_id, year, swid, espn_s2):
+    """Returns the top free agents as column lists (cached on the league credentials)."""
+    # One request: ESPN has no paging, and per-position requests can't reproduce its ranking
+    return build_columns(_league.free_agents(size=FA_LIMIT), "Free Agent")
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=REPORT_CACHE_ENTRIES, show_spinner=False)
+def build_report(team_rosters, fa_columns):
+    """Builds the workbook bytes and the sorted master DataFrame from the sheet columns."""
+    all_players_columns = {column: [] for column in HEADERS}
+
+    # PyExcelerate renders sheet XML directly from plain lists, skipping per-cell objects
+    wb = Workbook()
+
+    # Excel rejects repeated sheet names, so team tabs can't take the fixed tab names either
+    used_sheet_names = {"free agents", "all players status"}
+    # The master tab holds every other tab's rows, so its widths are the running max of theirs
+    master_widths = [len(column) for column in HEADERS]
+    for team_name, roster_columns in team_rosters:
+        widths = write_sheet(wb, clean_sheet_name(team_name, used_sheet_names), roster_columns)
+        master_widths = list(map(max, master_widths, widths))
+        for column, values in roster_columns.items():
+            all_players_columns[column].extend(values)
+
+    if fa_columns is not None:
+        widths = write_sheet(wb, "Free Agents", fa_columns)
+        master_widths = list(map(max, master_widths, widths))
+        for column, values in fa_columns.items():
+            all_players_columns[column].extend(values)
+
+    # Sort once by index over the names and reorder every column to match, rather than
+    # round-tripping through DataFrame.sort_values (None sorts as "" instead of failing)
+    sort_keys = [name or "" for name in all_players_columns["Player Name"]]
+    order = sorted(range(len(sort_keys)), key=sort_keys.__getitem__)
+    all_players_columns = {
+        column: [values[i] for i in order] for column, values in all_players_columns.items()
+    }
+    if order:
+        write_sheet(wb, "All Players Status", all_players_columns, master_widths)
+
+    # copy=False skips pandas' defensive copy of the dict input
+    df_all = pd.DataFrame(all_players_columns, copy=False)
+
+    # Small reports stay in memory; large ones spill to a temp file while the zip is written
+    with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as output:
+        wb.save(output)
+        output.seek(0)
+        excel_data = output.read()
+    return excel_data, df_all
 
 # --- MAIN LOGIC ---
 if st.button("🚀 Generate Excel Report"):
     try:
         with st.spinner("Connecting to ESPN API..."):
-            league = League(league_id=league_id, year=year, espn_s2=espn_s2, swid=swid)
+            league = get_league(league_id, year, swid, espn_s2)
             
         st.success(f"Successfully connected to: **{league.settings.name}**")
-        
-        # We use BytesIO so the file is created in memory (necessary for web hosting)
-        output = io.BytesIO()
-        
-        excluded_slots = {'UTIL', 'BE', 'IL', 'IF', 'LF', 'CF', 'RF', 'SP', 'RP'}
-        all_players_master_list = []
 
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            
-            # 1. Process Teams
-            progress_bar = st.progress(0)
-            for i, team in enumerate(league.teams):
-                roster_data = []
-                for player in team.roster:
-                    clean_slots = [slot for slot in player.eligibleSlots if slot not in excluded_slots]
-                    player_info = {
-                        "Player Name": player.name,
-                        "Fantasy Team": team.team_name,
-                        "Pro Team": player.proTeam,
-                        "Injury Status": player.injuryStatus,
-                        "Eligible Positions": ", ".join(clean_slots)
-                    }
-                    roster_data.append(player_info)
-                    all_players_master_list.append(player_info)
-                
-                df_team = pd.DataFrame(roster_data)
-                clean_sheet_name = re.sub(r'[\\/*?:\[\]]', '', team.team_name)[:31]
-                df_team.to_excel(writer, sheet_name=clean_sheet_name, index=False)
-                auto_adjust_column_width(writer, df_team, clean_sheet_name)
-                
-                # Update progress
-                progress_bar.progress((i + 1) / len(league.teams))
-
-            # 2. Process Free Agents
-            with st.spinner("Fetching Top 500 Free Agents..."):
-                try:
-                    free_agents = league.free_agents(size=500)
-                    fa_data = []
-                    for player in free_agents:
-                        clean_slots = [slot for slot in player.eligibleSlots if slot not in excluded_slots]
-                        fa_data.append({
-                            "Player Name": player.name,
-                            "Fantasy Team": "Free Agent",
-                            "Pro Team": player.proTeam,
-                            "Injury Status": player.injuryStatus,
-                            "Eligible Positions": ", ".join(clean_slots)
-                        })
-                    
-                    df_fa = pd.DataFrame(fa_data)
-                    df_fa.to_excel(writer, sheet_name="Free Agents", index=False)
-                    auto_adjust_column_width(writer, df_fa, "Free Agents")
-                    all_players_master_list.extend(fa_data)
-                except Exception as e:
-                    st.warning(f"Could not fetch Free Agents: {e}")
-
-            # 3. Master Tab
-            df_all = pd.DataFrame(all_players_master_list)
-            if not df_all.empty:
-                df_all = df_all.sort_values(by="Player Name")
-                df_all.to_excel(writer, sheet_name="All Players Status", index=False)
-                auto_adjust_column_width(writer, df_all, "All Players Status")
+        # 1. Process Teams (rosters come back with the league itself, no extra requests)
+        team_rosters = []
+        progress_bar = st.progress(0)
+        for i, team in enumerate(league.teams):
+            team_rosters.append((team.team_name, build_columns(team.roster, team.team_name)))
+
+            # Update progress
+            progress_bar.progress((i + 1) / len(league.teams))
+
+        # 2. Process Free Agents
+        with st.spinner(f"Fetching Top {FA_LIMIT} Free Agents..."):
+            try:
+                fa_columns = fetch_free_agents(league, league_id, year, swid, espn_s2)
+            except Exception as e:
+                fa_columns = None
+                st.warning(f"Could not fetch Free Agents: {e}")
+
+        # 3. Build the workbook (team tabs, Free Agents, master tab)
+        with st.spinner("Building Excel file..."):
+            excel_data, df_all = build_report(team_rosters, fa_columns)
 
         # --- PREPARE DOWNLOAD ---
-        excel_data = output.getvalue()
         file_name = f"{league.settings.name.replace(' ', '_')}_Roster_{year}.xlsx"
         
-        st.balloons()
         st.subheader("✅ Extraction Complete")
         
-        # Preview of the master list
-        st.dataframe(df_all, use_container_width=True)
+        # Preview of the master list (collapsed and capped so the full table isn't sent to the browser)
+        with st.expander("Preview first 200 rows"):
+            st.dataframe(df_all.head(200), use_container_width=True)
 
         st.download_button(
             label="📥 Download Excel File",